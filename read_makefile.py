@@ -1,82 +1,348 @@
 import re
 import os
+import stat
+import copy
 import glob
+import fnmatch
+from pathlib import Path
 
-def parse_include_files(makefile_path, parsed_files=None):
+# 以下の行単位のパターンは、1行ずつre.match()で適用する
+# （内容全体をMULTILINEで走査せず、部分文字列の事前チェックで不一致の行を読み飛ばす）
+
+# 変数定義のパターン
+# （値は最初の#より前の部分で、空でもよい。空白の連続で後戻りが増えないよう否定文字クラスで取る）
+_VAR_RE = re.compile(r'\s*([A-Za-z0-9_]+)\s*[:\+]?=\s*([^#]*)(?:#.*)?$')
+
+# $(VAR)や${VAR}形式の変数参照のパターン
+_VAR_REF_RE = re.compile(r'\$[\({]([A-Za-z0-9_]+)[\)}]')
+
+# includeディレクティブのパターン
+# （前後の空白はパターン側で除き、パスが空のincludeには一致しない）
+_INCLUDE_DIRECTIVE_RE = re.compile(r'\s*include\s+(\S+(?:\s+\S+)*)\s*$')
+
+# ソースファイルのパターン
+# 代入のワイルドカード（SRCS = src/*.c など）ならgroup(1)に、
+# 依存関係のファイル（foo: src/foo.cpp など）ならgroup(2)に、
+# 最初のC/C++ファイルのディレクトリパスが入る
+_SRC_DIR_RE = re.compile(
+    r'[ \t]*\w+[ \t]*(?:'
+    r'[:\+]?=[ \t]*(?:\S+[ \t]+)*?([^\s:=]+\/)\*'
+    r'|:(?!=)[ \t]*(?:\S+[ \t]+)*?([^\s:=]+\/)[\w\.]+'
+    r')\.(?:c|h|cc|cpp|cxx|hpp|hxx)\b'
+)
+
+# 言語検出のパターン
+# 先頭を\.のリテラルにして高速な前方検索を効かせるため、
+# 「..c」を除外する後読みは\.の後に置く
+_CPP_RE = re.compile(r'\.(?:cpp|cxx|cc|hpp|hxx)(?=\s|$)')
+_C_RE = re.compile(r'\.(?<!\.\.)c(?=\s|$)')
+_LANG_RE = re.compile(r'\.(?:(?P<cpp>cpp|cxx|cc|hpp|hxx)|(?<!\.\.)(?P<c>c))(?=\s|$)')
+
+# インクルードディレクトリのパターン
+_INCLUDE_DIR_PATTERNS = [re.compile(p) for p in (
+    r'-I\s*([^\s]+)',
+    r'INCLUDE\w*\s*[:\+]?=\s*([^\s#]+)'
+)]
+
+# analyze_makefileの結果のキャッシュ
+# 解析したMakefileのパスをキーに (各ファイルの更新時刻とサイズ, includeパスの解決結果, 解析結果) を保持する
+_ANALYSIS_CACHE = {}
+_ANALYSIS_CACHE_SIZE = 32
+
+# ワイルドカードの展開に使うディレクトリ一覧のキャッシュ
+# 同じディレクトリへの複数のワイルドカードincludeで何度も一覧を取らないようにする
+# （解析の開始時に毎回クリアする）
+_DIR_CACHE = {}
+
+def _collect_directives(lines):
     """
-    Makefileとincludeされている.mkファイルを再帰的に解析する
+    Makefileの各行から変数定義とincludeディレクティブを記述順に抽出する
+    
+    Args:
+        lines: Makefileの内容を行ごとに分割したリスト
+    
+    Returns:
+        (変数定義の (変数名, 値) のリスト, includeパス（変数展開前）) のリスト
+        変数定義はそのincludeより前（直前のincludeより後）の行のもので、
+        最後の要素はincludeより後の変数定義だけを持ち、includeパスはNone
+    """
+    directives = []
+    definitions = []
+    for line in lines:
+        if '=' in line and (match := _VAR_RE.match(line)):
+            definitions.append((match.group(1), match.group(2).strip()))
+        if 'include' in line and (match := _INCLUDE_DIRECTIVE_RE.match(line)):
+            directives.append((definitions, match.group(1)))
+            definitions = []
+    directives.append((definitions, None))
+    return directives
+
+def _cached_listdir(directory):
+    """
+    ディレクトリ内の通常のファイル名の一覧をキャッシュして返す
+    
+    Args:
+        directory: 一覧を取得するディレクトリ
+    
+    Returns:
+        ファイル名のリスト（サブディレクトリは含まず、ディレクトリが存在しない場合は空のリスト）
+    """
+    entries = _DIR_CACHE.get(directory)
+    if entries is None:
+        try:
+            with os.scandir(directory) as it:
+                entries = [entry.name for entry in it if entry.is_file()]
+        except OSError:
+            entries = []
+        _DIR_CACHE[directory] = entries
+    return entries
+
+def _glob_includes(base_dir, include_path):
+    """
+    ワイルドカードを含むincludeパスに一致するファイルを探す
+    
+    Args:
+        base_dir: includeしたファイルのディレクトリ
+        include_path: 変数展開済みのincludeパス
+    
+    Returns:
+        一致したファイルのresolve済みパスのリスト（ディレクトリは含まない）
+    """
+    # 絶対パスの場合はbase_dirは無視される
+    pattern = base_dir / include_path
+    
+    # ディレクトリ部分にもワイルドカードがある場合はglobで検索する
+    # （Path.globと違い、隠しファイル・ディレクトリは.で始まるパターンにしか一致しない）
+    if '*' in str(pattern.parent):
+        return [Path(path).resolve() for path in glob.glob(str(pattern)) if os.path.isfile(path)]
+    
+    # ファイル名部分だけがワイルドカードなら、キャッシュしたディレクトリ一覧から探す
+    # （globと同様に、パターンが.で始まらない限り隠しファイルは対象外）
+    directory = pattern.parent.resolve()
+    names = fnmatch.filter(_cached_listdir(directory), pattern.name)
+    if not pattern.name.startswith('.'):
+        names = [name for name in names if not name.startswith('.')]
+    return [(directory / name).resolve() for name in names]
+
+def _resolve_include(base_dir, include_path):
+    """
+    変数展開済みのincludeパスを、解析するファイルのパスに解決する
+    
+    Args:
+        base_dir: includeしたファイルのディレクトリ
+        include_path: 変数展開済みのincludeパス
+    
+    Returns:
+        resolve済みパスのタプル（ワイルドカードなら一致した全てのファイル）
+    """
+    if '*' in include_path:
+        return tuple(_glob_includes(base_dir, include_path))
+    # 相対パスはincludeしたファイルのディレクトリを基準にする
+    return ((base_dir / include_path).resolve(),)
+
+def _stat_fingerprint(stat):
+    """
+    ファイルの変更を検出するための (更新時刻, サイズ) を返す
+    
+    Args:
+        stat: os.stat_resultまたはNone（ファイルが存在しない場合）
+    
+    Returns:
+        (更新時刻（ナノ秒）, サイズ) のタプル、またはNone
+    """
+    if stat is None:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _is_unchanged(file_stats, resolved_includes):
+    """
+    解析したファイル群が、解析時から変更されていないか判定する
+    
+    Args:
+        file_stats: 解析時に記録したファイルごとの (更新時刻, サイズ) の辞書
+            （存在しなかったファイルや通常のファイルでなかったものはNone）
+        resolved_includes: 解析時に記録した (includeしたファイルのディレクトリ, includeパス, 解決結果) のリスト
+    
+    Returns:
+        全てのファイルとincludeパスの解決結果が解析時と同じならTrue
+    """
+    for path, recorded in file_stats.items():
+        try:
+            current = path.stat()
+        except OSError:
+            # 存在しなかったファイルが後から作られた場合も検出できるようにする
+            current = None
+        if current is not None and not stat.S_ISREG(current.st_mode):
+            current = None
+        if _stat_fingerprint(current) != recorded:
+            return False
+    
+    # ワイルドカードに一致するファイルの増減や、シンボリックリンクの付け替えも検出する
+    return all(
+        _resolve_include(base_dir, include_path) == resolved
+        for base_dir, include_path, resolved in resolved_includes
+    )
+
+def _store_analysis(cache_key, file_stats, resolved_includes, analysis):
+    """
+    解析結果をキャッシュする（上限を超えたら最も古いものから捨てる）
+    
+    Args:
+        cache_key: 解析したMakefileのresolve済みパス
+        file_stats: 解析時に記録したファイルごとの (更新時刻, サイズ) の辞書
+        resolved_includes: 解析時に記録したincludeパスの解決結果のリスト
+        analysis: 解析結果（呼び出し側での変更が影響しないようコピーして保持する）
+    """
+    if cache_key not in _ANALYSIS_CACHE and len(_ANALYSIS_CACHE) >= _ANALYSIS_CACHE_SIZE:
+        del _ANALYSIS_CACHE[next(iter(_ANALYSIS_CACHE))]
+    _ANALYSIS_CACHE[cache_key] = (file_stats, resolved_includes, copy.deepcopy(analysis))
+
+def parse_include_files(makefile_path, parsed_files=None, variables=None, resolved_includes=None, file_stats=None):
+    """
+    Makefileとincludeされている.mkファイルを順に解析する
+    
+    再帰呼び出しの代わりにスタックを使い、includeの深さに制限なく
+    深さ優先（include元 → includeされたファイルの順）で内容を集める
     
     Args:
         makefile_path: 解析するMakefileのパス
         parsed_files: 既に解析したファイルのセット（循環参照防止用）
+        variables: 解析中に収集した変数の辞書（同名の変数は後に読んだ定義で上書き）
+        resolved_includes: includeを (includeしたファイルのディレクトリ, 変数展開済みのincludeパス,
+            解決結果) として記録するリスト（キャッシュの検証用）
+        file_stats: 読み込んだ時点の各ファイルの (更新時刻, サイズ) を記録する辞書
+            （存在しなかったファイルはNone。キャッシュの検証用）
     
     Returns:
-        全てのファイルの内容を結合したテキスト
+        (全てのファイルの内容のリスト（呼び出し側で結合する）,
+         includeディレクティブに書かれたパス（変数展開前）のセット)
     """
     if parsed_files is None:
+        # 新しい解析の開始なので、前回のディレクトリ一覧は使わない
+        _DIR_CACHE.clear()
         parsed_files = set()
+    if variables is None:
+        variables = {}
+    if resolved_includes is None:
+        resolved_includes = []
+    if file_stats is None:
+        file_stats = {}
     
-    # 既に解析済みのファイルは再度解析しない（循環参照防止）
-    if makefile_path in parsed_files:
-        return ""
-    
-    # 解析済みファイルとして記録
-    parsed_files.add(makefile_path)
+    # includeパスの展開に使う、その時点で有効な変数
+    # makeと同様に、includeの行より前の定義（includeされたファイルの定義を含む）だけが見える
+    scope = dict(variables)
     
-    if not os.path.exists(makefile_path):
-        print(f"警告: ファイル {makefile_path} が見つかりません")
-        return ""
+    # 簡易的な変数展開（完全な処理は複雑なため、基本的なケースのみ対応）
+    def expand_var(match):
+        # 変数が見つからない場合は置換しない
+        return scope.get(match.group(1), match.group(0))
     
-    # ファイルを読み込む
-    with open(makefile_path, 'r', errors='ignore') as file:
-        content = file.read()
+    # 文字列の連結を繰り返さないよう、リストに溜めて最後に一度だけ結合する
+    pieces = []
+    included_files = set()
     
-    # includeディレクティブを検索
-    include_pattern = re.compile(r'^\s*include\s+(.+)$', re.MULTILINE)
-    
-    # 現在のディレクトリをベースディレクトリとする
-    base_dir = os.path.dirname(makefile_path)
-    
-    # 全てのincludeファイルの内容を取得
-    for match in include_pattern.finditer(content):
-        include_path = match.group(1).strip()
+    # (種類, 値, includeしたファイルのディレクトリ) のスタック
+    # 'file'はresolve済みのパス、'define'は変数定義のリスト、
+    # 'include'は未展開のincludeディレクティブで、記述順に取り出されるよう積む
+    # パスは全てresolve済みのPathとして扱い、同じファイルを別の表記で二重に解析しない
+    stack = [('file', Path(makefile_path).resolve(), None)]
+    while stack:
+        kind, include_path, base_dir = stack.pop()
         
-        # 変数展開を簡易的に処理
-        # $(VAR)や${VAR}形式の変数展開を処理
-        var_pattern = re.compile(r'\$[\({]([A-Za-z0-9_]+)[\)}]')
+        if kind == 'define':
+            scope.update(include_path)
+            continue
         
-        # 簡易的な変数展開（完全な処理は複雑なため、基本的なケースのみ対応）
-        def expand_var(match):
-            var_name = match.group(1)
-            # 変数の値を探す（簡易的な実装）
-            var_pattern = re.compile(r'^\s*' + re.escape(var_name) + r'\s*[:\+]?=\s*(.+?)(?:\s*#.*)?$', re.MULTILINE)
-            var_match = var_pattern.search(content)
-            if var_match:
-                return var_match.group(1).strip()
-            return match.group(0)  # 変数が見つからない場合は置換しない
+        if kind == 'include':
+            # $(VAR)や${VAR}形式の変数展開を処理
+            include_path = _VAR_REF_RE.sub(expand_var, include_path)
+            
+            # 展開結果が空のincludeはmakeと同様に何もしない
+            if not include_path.strip():
+                continue
+            
+            # パスを解決し（ワイルドカードは展開し）、結果を記録しておく
+            # （未解決のパスから検証し直すことで、シンボリックリンクの付け替えも検出できる）
+            include_files = _resolve_include(base_dir, include_path)
+            resolved_includes.append((base_dir, include_path, include_files))
+            stack.extend(('file', include_file, None) for include_file in reversed(include_files))
+            continue
         
-        include_path = var_pattern.sub(expand_var, include_path)
+        # 既に解析済みのファイルは再度解析しない（循環参照防止）
+        if include_path in parsed_files:
+            continue
         
-        # 相対パスを絶対パスに変換
-        if not os.path.isabs(include_path):
-            include_path = os.path.normpath(os.path.join(base_dir, include_path))
+        # 解析済みファイルとして記録
+        parsed_files.add(include_path)
         
-        # ワイルドカードを処理
-        if '*' in include_path:
-            include_files = glob.glob(include_path)
-            for include_file in include_files:
-                content += parse_include_files(include_file, parsed_files)
-        else:
-            content += parse_include_files(include_path, parsed_files)
+        # ディレクトリなど通常のファイルでないものは開かない
+        if not include_path.is_file():
+            file_stats[include_path] = None
+            print(f"警告: ファイル {include_path} が見つかりません")
+            continue
+        
+        # ファイルを読み込む
+        # （bytesのまま扱ってもASCIIのstrと同じく1バイト単位で照合されるため正規表現は
+        #   速くならず、短い行ごとのmatch()はかえって遅くなるので、strとして読む）
+        # 読み込む前の状態を記録し、読み込み中やその後の変更は次回の検証で検出されるようにする
+        with open(include_path, 'r', errors='ignore') as file:
+            file_stats[include_path] = _stat_fingerprint(os.fstat(file.fileno()))
+            content = file.read()
+        
+        # 先頭にNUL文字を含むファイルはバイナリとみなし、解析しない
+        if '\x00' in content[:4096]:
+            print(f"警告: ファイル {include_path} はMakefileではありません")
+            continue
+        pieces.append(content)
+        
+        # 変数定義とincludeディレクティブを記述順に一度だけ抽出する
+        lines = content.split('\n')
+        base_dir = include_path.parent
+        items = []
+        for definitions, include in _collect_directives(lines):
+            variables.update(definitions)
+            if definitions:
+                items.append(('define', definitions, None))
+            if include is not None:
+                included_files.add(include)
+                items.append(('include', include, base_dir))
+        
+        # 記述順に処理されるよう逆順に積む
+        stack.extend(reversed(items))
     
-    return content
+    return pieces, included_files
 
 def analyze_makefile(makefile_path):
     """
     Makefileとincludeされている全ての.mkファイルを解析する
+    
+    前回の解析以降、includeされている全てのファイルの更新時刻とサイズ、
+    includeパスの解決結果が変わっていなければキャッシュした結果を返す
+    
+    内容が空（または空白のみ）の場合や、バイナリファイルしかない場合は
+    解析を行わず、空の結果を返す
     """
-    # 全てのファイルの内容を結合
-    content = parse_include_files(makefile_path)
+    # ディレクトリ一覧はキャッシュの検証と解析の間でだけ共有する
+    _DIR_CACHE.clear()
+    
+    # キャッシュが有効ならファイルを読まずに結果を返す
+    # （呼び出し側での変更がキャッシュに影響しないようコピーを返す）
+    cache_key = Path(makefile_path).resolve()
+    cached = _ANALYSIS_CACHE.get(cache_key)
+    if cached is not None:
+        file_stats, resolved_includes, analysis = cached
+        if _is_unchanged(file_stats, resolved_includes):
+            return copy.deepcopy(analysis)
+    
+    # 全てのファイルの内容を結合し、同時に変数を収集する
+    parsed_files = set()
+    variables = {}
+    resolved_includes = []
+    file_stats = {}
+    pieces, included_files = parse_include_files(
+        makefile_path, parsed_files, variables, resolved_includes, file_stats
+    )
+    content = "".join(pieces)
     
     # 解析結果を格納する辞書
     analysis = {
@@ -84,41 +350,44 @@ def analyze_makefile(makefile_path):
         'language': None,  # 'C' or 'C++' or 'Both'
         'include_directories': set(),
         'has_multithreading': False,
-        'included_files': set()  # includeされたファイルのリスト
+        'included_files': included_files  # includeされたファイルのリスト
     }
     
-    # このあとは前回同様の解析コードを続ける
-    # 変数の抽出
-    variables = {}
-    var_pattern = re.compile(r'^\s*([A-Za-z0-9_]+)\s*[:\+]?=\s*(.+?)(?:\s*#.*)?$', re.MULTILINE)
-    for match in var_pattern.finditer(content):
-        key, value = match.groups()
-        variables[key] = value.strip()
+    # 解析する内容がなければ以降の走査を省略する
+    # （空の結果もキャッシュし、次回からincludeの走査も省く）
+    if not content or content.isspace():
+        _store_analysis(cache_key, file_stats, resolved_includes, analysis)
+        return analysis
     
+    # このあとは前回同様の解析コードを続ける
     # ソースディレクトリの検出
-    for key in ['SRCDIR', 'SRC_DIR', 'SOURCE_DIR', 'SOURCES_DIR']:
-        if key in variables:
-            analysis['source_directories'].add(variables[key])
+    analysis['source_directories'] = {
+        variables[key]
+        for key in ['SRCDIR', 'SRC_DIR', 'SOURCE_DIR', 'SOURCES_DIR']
+        if key in variables
+    }
     
     # ソースファイルのパターンから推測
-    src_patterns = [
-        r'^\s*\w+\s*=\s*(.+\/)*\*\.[ch]pp', # C++ファイルを含むパターン
-        r'^\s*\w+\s*=\s*(.+\/)*\*\.[ch]',   # Cファイルを含むパターン
-        r'^\s*[A-Za-z0-9_]+\s*:\s*(.+\/)*[\w\.]+\.[ch]pp', # 依存関係からC++を検出
-        r'^\s*[A-Za-z0-9_]+\s*:\s*(.+\/)*[\w\.]+\.[ch]'    # 依存関係からCを検出
-    ]
-    
-    for pattern in src_patterns:
-        for match in re.finditer(pattern, content, re.MULTILINE):
-            line = match.group(0)
-            # ディレクトリパスを抽出
-            dir_match = re.search(r'([^\s:=]+\/)[^\/]*\.[ch]', line)
-            if dir_match:
-                analysis['source_directories'].add(dir_match.group(1))
+    lines = content.split('\n')
+    analysis['source_directories'] |= {
+        match.group(1) or match.group(2)
+        for line in lines
+        if '/' in line and (match := _SRC_DIR_RE.match(line))
+    }
     
     # 言語の検出
-    cpp_files = re.search(r'\.(cpp|cxx|cc|hpp|hxx)(?:\s|$)', content) is not None
-    c_files = re.search(r'(?<!\.)\.c(?:\s|$)', content) is not None
+    # 最初に見つかった方の言語を記録し、もう一方はその位置から続けて探す
+    # （内容を先頭から二度走査せず、一致ごとのPythonの処理も発生しない）
+    cpp_files = False
+    c_files = False
+    match = _LANG_RE.search(content)
+    if match is not None:
+        if match.lastgroup == 'cpp':
+            cpp_files = True
+            c_files = _C_RE.search(content, match.end()) is not None
+        else:
+            c_files = True
+            cpp_files = _CPP_RE.search(content, match.end()) is not None
     
     if cpp_files and c_files:
         analysis['language'] = 'Both'
@@ -128,37 +397,20 @@ def analyze_makefile(makefile_path):
         analysis['language'] = 'C'
     
     # インクルードディレクトリの検出
-    include_patterns = [
-        r'-I\s*([^\s]+)',
-        r'INCLUDE\w*\s*[:\+]?=\s*([^\s#]+)'
-    ]
-    
-    for pattern in include_patterns:
-        for match in re.finditer(pattern, content):
-            path = match.group(1).strip()
-            analysis['include_directories'].add(path)
+    # （パターンが空白を含まないパスだけを取り出すため、strip()は不要）
+    # グループが1つだけなので、findall()でMatchオブジェクトを作らずに文字列を直接得る
+    analysis['include_directories'] = set().union(
+        *(pattern.findall(content) for pattern in _INCLUDE_DIR_PATTERNS)
+    )
     
     # マルチスレッド関連の検出
-    thread_indicators = [
-        r'-lpthread',
-        r'-pthread',
-        r'thread',
-        r'pthread',
-        r'std::thread',
-        r'boost::thread',
-        r'#include\s*[<"]thread[">]'
-    ]
-    
-    for indicator in thread_indicators:
-        if re.search(indicator, content, re.IGNORECASE):
-            analysis['has_multithreading'] = True
-            break
-    
-    # includeファイルの記録
-    include_pattern = re.compile(r'^\s*include\s+(.+)$', re.MULTILINE)
-    for match in include_pattern.finditer(content):
-        include_path = match.group(1).strip()
-        analysis['included_files'].add(include_path)
+    # -lpthread, -pthread, std::thread, boost::thread, #include <thread> などは
+    # 全て "thread" を含むため、部分文字列検索で判定できる
+    # 通常は小文字で書かれるので、まずそのまま探し、見つからない場合だけ
+    # 内容全体を小文字化して大文字の表記（NUM_THREADSなど）を探す
+    analysis['has_multithreading'] = 'thread' in content or 'thread' in content.casefold()
+    
+    _store_analysis(cache_key, file_stats, resolved_includes, analysis)
     
     return analysis
 